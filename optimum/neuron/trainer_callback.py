@@ -39,7 +39,7 @@ from .utils.cache_utils import (
     get_neuron_cache_path,
     list_files_in_neuron_cache,
     path_after_folder,
-    push_to_cache_on_hub,
+    push_files_to_cache_on_hub,
     set_neuron_cache_path,
 )
 
@@ -79,12 +79,19 @@ class NeuronCacheCallback(TrainerCallback):
         push: bool = True,
         wait_for_everyone_on_fetch: bool = True,
         wait_for_everyone_on_push: bool = True,
+        wait_for_everyone_on_first_fetch: bool = False,
     ):
         super().__init__()
         self.fetch = fetch
         self.push = push
         self.wait_for_everyone_on_fetch = is_torch_xla_available() and wait_for_everyone_on_fetch
         self.wait_for_everyone_on_push = is_torch_xla_available() and wait_for_everyone_on_push
+        # Synchronizing on the first fetch prevents the processes that do not fetch from compiling graphs that the
+        # main process is downloading. It is only safe when the first call to `on_step_middle`, reached from both
+        # `compute_loss` and `prediction_step`, happens on every rank: running `evaluate()` or `predict()` on the main
+        # process only before training would hang.
+        self.wait_for_everyone_on_first_fetch = is_torch_xla_available() and wait_for_everyone_on_first_fetch
+        self._waited_on_first_fetch = False
 
         # Real Neuron compile cache if it exists.
         if original_neuron_cache_path is None:
@@ -284,8 +291,9 @@ class NeuronCacheCallback(TrainerCallback):
                 else:
                     return path_after_folder(path, f"USER_neuroncc-{neuron_hash.neuron_compiler_version}")
 
+            if files:
+                push_files_to_cache_on_hub(neuron_hash, files, local_path_to_path_in_repo=local_path_to_path_in_repo)
             for path in files:
-                push_to_cache_on_hub(neuron_hash, path, local_path_to_path_in_repo=local_path_to_path_in_repo)
                 if self.use_neuron_cache:
                     path_in_cache = self.full_path_to_path_in_temporary_cache(path)
                     target_file = self.neuron_cache_path / path_in_cache
@@ -302,8 +310,10 @@ class NeuronCacheCallback(TrainerCallback):
         if self.fetch:
             model = kwargs["model"]
             self.neuron_hash_for_model(args, model, state.last_inputs, try_to_fetch_cached_model=True)
-        if self.wait_for_everyone_on_fetch:
+        wait_on_first_fetch = self.wait_for_everyone_on_first_fetch and not self._waited_on_first_fetch
+        if self.wait_for_everyone_on_fetch or wait_on_first_fetch:
             xm.rendezvous("wait for everyone after fetching")
+            self._waited_on_first_fetch = True
 
     def on_step_end(self, args: "TrainingArguments", state: "TrainerState", control: "TrainerControl", **kwargs):
         """
@@ -171,6 +171,7 @@ class AugmentTrainerForNeuronMixin:
             push=push,
             wait_for_everyone_on_fetch=False,
             wait_for_everyone_on_push=True,
+            wait_for_everyone_on_first_fetch=True,
         )
         self.add_callback(callback)
 
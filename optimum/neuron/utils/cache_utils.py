@@ -22,9 +22,10 @@ import re
 import shutil
 import subprocess
 import tempfile
+import time
 from dataclasses import InitVar, asdict, dataclass, field
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 import huggingface_hub
 import numpy as np
@@ -80,9 +81,19 @@ _HF_HUB_HTTP_ERROR_REQUEST_ID_PATTERN = re.compile(r"\(Request ID: Root=[\w-]+\)
 _WRITING_ACCESS_CACHE: Dict[Tuple[str, str], bool] = {}
 _REGISTRY_FILE_EXISTS: Dict[str, bool] = {}
 _ADDED_IN_REGISTRY: Dict[Tuple[str, "NeuronHash"], bool] = {}
+# Maps a directory to its `st_mtime_ns` and the time of its last scan, and the files and sub-directories it contained.
+_NEURON_CACHE_DIR_SCANS: Dict[str, Tuple[int, int, List[str], List[str]]] = {}
+_MAX_NEURON_CACHE_DIR_SCANS = 10_000
+# Some filesystems only have a 1-2s mtime granularity, and the kernel only updates timestamps once per clock tick.
+_NEURON_CACHE_DIR_SCAN_MTIME_MARGIN_NS = 2 * 10**9
 
 _NEW_CACHE_NAMING_CONVENTION_NEURONXCC_VERSION = "2.7.0.40+f7c6cf2a3"
 
+_COULD_NOT_PUSH_MESSAGE = (
+    "Could not push the cached model to the repo {cache_repo_id}, most likely due to not having the write permission "
+    "for this repo. Exact error:\n{error}."
+)
+
 # For testing purposes.
 _DISABLE_IS_PRIVATE_REPO_CHECK: bool = string_to_bool(
     os.environ.get("OPTIMUM_NEURON_DISABLE_IS_PRIVATE_REPO_CHECK", "false")
@@ -285,8 +296,63 @@ def get_num_neuron_cores_used() -> int:
     return int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
 
 
+def _scan_neuron_cache_dir(path: str) -> Tuple[List[str], List[str]]:
+    """
+    Returns the files and the sub-directories directly under `path`.
+
+    A directory's mtime only changes when entries are added, removed or renamed in it, so the result of the last
+    scan is reused as long as the mtime did not change. Since the mtime has a limited granularity, an entry added in
+    the same tick as the scan would leave it unchanged: the result is only reused when the mtime was already
+    `_NEURON_CACHE_DIR_SCAN_MTIME_MARGIN_NS` older than the scan.
+    """
+    scan_time_ns = time.time_ns()
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        _NEURON_CACHE_DIR_SCANS.pop(path, None)
+        return [], []
+    last_scan = _NEURON_CACHE_DIR_SCANS.get(path)
+    if (
+        last_scan is not None
+        and last_scan[0] == mtime_ns
+        and mtime_ns + _NEURON_CACHE_DIR_SCAN_MTIME_MARGIN_NS < last_scan[1]
+    ):
+        return last_scan[2], last_scan[3]
+
+    files, sub_directories = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                sub_directories.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+
+    # Re-inserting the entry keeps the dictionary ordered from the least to the most recently scanned directory.
+    _NEURON_CACHE_DIR_SCANS.pop(path, None)
+    if len(_NEURON_CACHE_DIR_SCANS) >= _MAX_NEURON_CACHE_DIR_SCANS:
+        del _NEURON_CACHE_DIR_SCANS[next(iter(_NEURON_CACHE_DIR_SCANS))]
+    _NEURON_CACHE_DIR_SCANS[path] = (mtime_ns, scan_time_ns, files, sub_directories)
+    return files, sub_directories
+
+
 def list_files_in_neuron_cache(neuron_cache_path: Path, only_relevant_files: bool = False) -> List[Path]:
-    files = [path for path in neuron_cache_path.glob("**/*") if path.is_file()]
+    root = os.fspath(neuron_cache_path)
+    files = []
+    scanned_directories = set()
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        scanned_directories.add(directory)
+        files_in_directory, sub_directories = _scan_neuron_cache_dir(directory)
+        files.extend(Path(filename) for filename in files_in_directory)
+        directories.extend(sub_directories)
+
+    # Forgets the directories under `neuron_cache_path` that do not exist anymore.
+    prefix = os.path.join(root, "")
+    for directory in list(_NEURON_CACHE_DIR_SCANS):
+        if directory.startswith(prefix) and directory not in scanned_directories:
+            del _NEURON_CACHE_DIR_SCANS[directory]
+
     if only_relevant_files:
         files = [p for p in files if p.suffix in [".neff", ".pb", ".txt"]]
     return files
@@ -304,7 +370,20 @@ def path_after_folder(path: Path, folder: Union[str, Path], include_folder: bool
 
 
 def remove_ip_adress_from_path(path: Path) -> Path:
-    return Path().joinpath(*(re.sub(_IP_PATTERN, "", part) for part in path.parts))
+    # The pattern cannot match across a path separator, so it can be applied to the whole path at once.
+    return Path(_IP_PATTERN.sub("", path.as_posix()))
+
+
+def remove_ip_adress_from_paths(paths: Iterable[Path]) -> List[Path]:
+    """
+    Same as `remove_ip_adress_from_path` for many paths, the pattern is applied once over all the paths joined
+    together instead of once per path.
+    """
+    paths = list(paths)
+    if not paths:
+        return []
+    joined_paths = "\n".join(path.as_posix() for path in paths)
+    return [Path(path) for path in _IP_PATTERN.sub("", joined_paths).split("\n")]
 
 
 def _get_model_name_or_path(config: "PretrainedConfig") -> Optional[str]:
@@ -803,13 +882,7 @@ def download_cached_model_from_hub(
     return cached_model is not None
 
 
-def push_to_cache_on_hub(
-    neuron_hash: NeuronHash,
-    local_cache_dir_or_file: Path,
-    cache_repo_id: Optional[str] = None,
-    overwrite_existing: bool = False,
-    local_path_to_path_in_repo: Optional[Callable[[Path], Path]] = None,
-) -> CachedModelOnTheHub:
+def _prepare_cache_repo_for_pushing(neuron_hash: NeuronHash, cache_repo_id: Optional[str] = None) -> str:
     if cache_repo_id is None:
         cache_repo_id = get_hf_hub_cache_repos()[0]
 
@@ -825,16 +898,34 @@ def push_to_cache_on_hub(
             f"Cannot push the cached model to {cache_repo_id} because this repo is not private but the original model is "
             "coming from private repo."
         )
+    return cache_repo_id
 
+
+def _get_path_in_repo(
+    neuron_hash: NeuronHash, local_path: Path, local_path_to_path_in_repo: Optional[Callable[[Path], Path]] = None
+) -> Path:
     if local_path_to_path_in_repo is not None:
-        path_in_repo = local_path_to_path_in_repo(local_cache_dir_or_file)
+        path_in_repo = local_path_to_path_in_repo(local_path)
     else:
-        path_in_repo = local_cache_dir_or_file
+        path_in_repo = local_path
 
     # Joining a path to a absolute path ignores the original path, so we remove the root directory "/" in this case.
     if path_in_repo.is_absolute():
         path_in_repo = Path().joinpath(*path_in_repo.parts[1:])
-    path_in_repo = neuron_hash.cache_path / path_in_repo
+    return neuron_hash.cache_path / path_in_repo
+
+
+def push_to_cache_on_hub(
+    neuron_hash: NeuronHash,
+    local_cache_dir_or_file: Path,
+    cache_repo_id: Optional[str] = None,
+    overwrite_existing: bool = False,
+    local_path_to_path_in_repo: Optional[Callable[[Path], Path]] = None,
+) -> CachedModelOnTheHub:
+    cache_repo_id = _prepare_cache_repo_for_pushing(neuron_hash, cache_repo_id=cache_repo_id)
+    path_in_repo = _get_path_in_repo(
+        neuron_hash, local_cache_dir_or_file, local_path_to_path_in_repo=local_path_to_path_in_repo
+    )
 
     repo_filenames = map(Path, HfApi().list_repo_files(cache_repo_id, token=HfFolder.get_token()))
     if local_cache_dir_or_file.is_dir():
@@ -854,10 +945,6 @@ def push_to_cache_on_hub(
                 f"{local_cache_dir_or_file}"
             )
 
-    could_not_push_message = (
-        "Could not push the cached model to the repo {cache_repo_id}, most likely due to not having the write permission "
-        "for this repo. Exact error:\n{error}."
-    )
     if local_cache_dir_or_file.is_dir():
         try:
             with tempfile.TemporaryDirectory() as tmpdirname:
@@ -883,7 +970,7 @@ def push_to_cache_on_hub(
                     repo_type="model",
                 )
         except HfHubHTTPError as e:
-            msg = could_not_push_message.format(cache_repo_id=cache_repo_id, error=e)
+            msg = _COULD_NOT_PUSH_MESSAGE.format(cache_repo_id=cache_repo_id, error=e)
             msg = re.sub(_HF_HUB_HTTP_ERROR_REQUEST_ID_PATTERN, "", msg)
             warn_once(logger, msg)
     else:
@@ -904,7 +991,7 @@ def push_to_cache_on_hub(
                     repo_type="model",
                 )
         except HfHubHTTPError as e:
-            msg = could_not_push_message.format(cache_repo_id=cache_repo_id, error=e)
+            msg = _COULD_NOT_PUSH_MESSAGE.format(cache_repo_id=cache_repo_id, error=e)
             msg = re.sub(_HF_HUB_HTTP_ERROR_REQUEST_ID_PATTERN, "", msg)
             warn_once(logger, msg)
 
@@ -915,3 +1002,64 @@ def push_to_cache_on_hub(
         pass
 
     return CachedModelOnTheHub(cache_repo_id, path_in_repo)
+
+
+def push_files_to_cache_on_hub(
+    neuron_hash: NeuronHash,
+    local_cache_files: List[Path],
+    cache_repo_id: Optional[str] = None,
+    overwrite_existing: bool = False,
+    local_path_to_path_in_repo: Optional[Callable[[Path], Path]] = None,
+) -> CachedModelOnTheHub:
+    """
+    Pushes several cached files related to `neuron_hash` to the cache repo on the Hub in a single commit.
+
+    Unlike calling `push_to_cache_on_hub` for each file, the repo is listed only once and all the files are uploaded
+    within one commit. IP addresses are removed from the paths in the repo, and files already in the repo are skipped
+    unless `overwrite_existing=True`.
+    """
+    cache_repo_id = _prepare_cache_repo_for_pushing(neuron_hash, cache_repo_id=cache_repo_id)
+
+    repo_filenames = set(HfApi().list_repo_files(cache_repo_id, token=HfFolder.get_token()))
+    operations = []
+    for local_cache_file in local_cache_files:
+        path_in_repo = _get_path_in_repo(
+            neuron_hash, local_cache_file, local_path_to_path_in_repo=local_path_to_path_in_repo
+        )
+        path_in_repo = remove_ip_adress_from_path(path_in_repo).as_posix()
+        if path_in_repo in repo_filenames:
+            if not overwrite_existing:
+                logger.info(
+                    f"Did not push the cached model located at {local_cache_file} to the repo named {cache_repo_id} "
+                    "because it already exists there. Use overwrite_existing=True if you want to overwrite the cache "
+                    "on the Hub."
+                )
+                continue
+            logger.warning(
+                f"Overwriting the already existing cached model on the Hub by the one located at {local_cache_file}"
+            )
+        operations.append(CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=local_cache_file.as_posix()))
+
+    if operations:
+        try:
+            HfApi().create_commit(
+                cache_repo_id,
+                operations=operations,
+                commit_message=f"Add cached files for NeuronHash {neuron_hash.compute_hash()[1]}",
+            )
+        except HfHubHTTPError as e:
+            msg = _COULD_NOT_PUSH_MESSAGE.format(cache_repo_id=cache_repo_id, error=e)
+            msg = re.sub(_HF_HUB_HTTP_ERROR_REQUEST_ID_PATTERN, "", msg)
+            warn_once(logger, msg)
+
+    # Adding the model to the registry.
+    try:
+        add_in_registry(cache_repo_id, neuron_hash)
+    except HfHubHTTPError:
+        pass
+
+    return CachedModelOnTheHub(
+        cache_repo_id,
+        neuron_hash.cache_path,
+        files_on_the_hub=[operation.path_in_repo for operation in operations],
+    )
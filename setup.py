@@ -31,6 +31,7 @@ TESTS_REQUIRE = [
     "sacremoses",
     "diffusers >= 0.20.0",
     "safetensors",
+    "huggingface_hub >= 0.17.0",
 ]
 
 QUALITY_REQUIRES = [
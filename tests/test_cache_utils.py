@@ -18,11 +18,14 @@ import json
 import logging
 import os
 import random
+import shutil
+import time
 from dataclasses import FrozenInstanceError
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import List
 from unittest import TestCase
+from unittest.mock import patch
 
 import torch
 from huggingface_hub import HfApi, HfFolder, create_repo, delete_repo, hf_hub_download
@@ -31,6 +34,7 @@ from transformers.testing_utils import TOKEN as TRANSFORMERS_TOKEN
 from transformers.testing_utils import USER as TRANSFORMERS_USER
 from transformers.testing_utils import is_staging_test
 
+from optimum.neuron.utils import cache_utils
 from optimum.neuron.utils.cache_utils import (
     CACHE_REPO_FILENAME,
     NEURON_COMPILE_CACHE_NAME,
@@ -49,8 +53,10 @@ from optimum.neuron.utils.cache_utils import (
     list_in_registry,
     load_custom_cache_repo_name_from_hf_home,
     path_after_folder,
+    push_files_to_cache_on_hub,
     push_to_cache_on_hub,
     remove_ip_adress_from_path,
+    remove_ip_adress_from_paths,
     set_custom_cache_repo_name_in_hf_home,
     set_neuron_cache_path,
 )
@@ -169,6 +175,88 @@ class NeuronUtilsTestCase(TestCase):
                 set(filenames), set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True))
             )
 
+    def test_list_files_in_neuron_cache_sees_new_nested_files(self):
+        with TemporaryDirectory() as tmpdirname:
+            filenames = self._create_random_neuron_cache(Path(tmpdirname), return_only_relevant_files=True)
+            self.assertSetEqual(
+                set(filenames), set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True))
+            )
+
+            # Adding a file in an existing nested directory does not change the mtime of the root directory.
+            new_file = filenames[0].parent / f"{get_random_string(6)}.neff"
+            new_file.touch()
+            self.assertSetEqual(
+                set(filenames + [new_file]),
+                set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True)),
+            )
+
+    def test_list_files_in_neuron_cache_reuses_old_scans(self):
+        with TemporaryDirectory() as tmpdirname:
+            filenames = self._create_random_neuron_cache(Path(tmpdirname), return_only_relevant_files=True)
+            old_mtime_ns = time.time_ns() - 10 * cache_utils._NEURON_CACHE_DIR_SCAN_MTIME_MARGIN_NS
+            for directory, _, _ in os.walk(tmpdirname):
+                os.utime(directory, ns=(old_mtime_ns, old_mtime_ns))
+            expected = set(filenames)
+            self.assertSetEqual(expected, set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True)))
+
+            with patch("optimum.neuron.utils.cache_utils.os.scandir", wraps=os.scandir) as mock_scandir:
+                self.assertSetEqual(
+                    expected, set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True))
+                )
+                mock_scandir.assert_not_called()
+
+    def test_list_files_in_neuron_cache_sees_files_added_in_the_same_mtime_tick(self):
+        with TemporaryDirectory() as tmpdirname:
+            filenames = self._create_random_neuron_cache(Path(tmpdirname), return_only_relevant_files=True)
+            self.assertSetEqual(
+                set(filenames), set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True))
+            )
+
+            # Simulates a coarse mtime granularity: the directory mtime stays the same after adding the file.
+            directory = filenames[0].parent
+            mtime_ns = directory.stat().st_mtime_ns
+            new_file = directory / f"{get_random_string(6)}.neff"
+            new_file.touch()
+            os.utime(directory, ns=(mtime_ns, mtime_ns))
+            self.assertSetEqual(
+                set(filenames + [new_file]),
+                set(list_files_in_neuron_cache(Path(tmpdirname), only_relevant_files=True)),
+            )
+
+    def test_list_files_in_neuron_cache_forgets_deleted_directories(self):
+        with TemporaryDirectory() as tmpdirname:
+            root = Path(tmpdirname)
+            kept_file = root / "kept" / "a.neff"
+            deleted_file = root / "deleted" / "nested" / "b.neff"
+            for filename in [kept_file, deleted_file]:
+                filename.parent.mkdir(parents=True)
+                filename.touch()
+            self.assertSetEqual(
+                {kept_file, deleted_file}, set(list_files_in_neuron_cache(root, only_relevant_files=True))
+            )
+            self.assertIn(os.fspath(deleted_file.parent), cache_utils._NEURON_CACHE_DIR_SCANS)
+
+            shutil.rmtree(root / "deleted")
+            self.assertSetEqual({kept_file}, set(list_files_in_neuron_cache(root, only_relevant_files=True)))
+            self.assertNotIn(os.fspath(root / "deleted"), cache_utils._NEURON_CACHE_DIR_SCANS)
+            self.assertNotIn(os.fspath(deleted_file.parent), cache_utils._NEURON_CACHE_DIR_SCANS)
+
+        self.assertListEqual(list_files_in_neuron_cache(root), [])
+        self.assertFalse(any(d.startswith(tmpdirname) for d in cache_utils._NEURON_CACHE_DIR_SCANS))
+
+    def test_remove_ip_adress_from_path(self):
+        paths = [
+            Path("/var/tmp/neuron-compile-cache/USER_neuroncc-2.4.0+ip-10-0-12-34-/MODULE_1234+ip-10-0-12-34-/a.neff"),
+            Path("neuronxcc-2.8.0/MODULE_5678/model.neff"),
+        ]
+        expected_paths = [
+            Path("/var/tmp/neuron-compile-cache/USER_neuroncc-2.4.0+/MODULE_1234+/a.neff"),
+            Path("neuronxcc-2.8.0/MODULE_5678/model.neff"),
+        ]
+        self.assertListEqual([remove_ip_adress_from_path(path) for path in paths], expected_paths)
+        self.assertListEqual(remove_ip_adress_from_paths(paths), expected_paths)
+        self.assertListEqual(remove_ip_adress_from_paths([]), [])
+
     def test_list_in_registry_dict(self):
         registry = {
             "2.1.0": {
@@ -615,6 +703,78 @@ class CachedModelOnTheHubTestCase(StagingTestMixin, TestCase):
                     )
                     self.assertIn(path_in_repo, files_in_repo)
 
+    def test_push_files_to_cache_on_hub(self):
+        with TemporaryDirectory() as tmpdirname:
+            set_neuron_cache_path(tmpdirname)
+
+            input_shapes = (("x", (1,)),)
+            data_type = torch.float32
+            tiny_model = self.create_and_run_tiny_pretrained_model(random_num_linears=True)
+            neuron_hash = NeuronHash(tiny_model, input_shapes, data_type)
+
+            cache_dir = Path(tmpdirname) / NEURON_COMPILE_CACHE_NAME
+            cached_files = list_files_in_neuron_cache(cache_dir)
+
+            def local_path_to_path_in_repo(path):
+                return path_after_folder(path, cache_dir)
+
+            api = HfApi()
+            num_commits_before = len(api.list_repo_commits(self.CUSTOM_PRIVATE_CACHE_REPO))
+            cached_model_on_the_hub = push_files_to_cache_on_hub(
+                neuron_hash,
+                cached_files,
+                self.CUSTOM_PRIVATE_CACHE_REPO,
+                local_path_to_path_in_repo=local_path_to_path_in_repo,
+            )
+            commits = api.list_repo_commits(self.CUSTOM_PRIVATE_CACHE_REPO)
+            files_commits = [commit for commit in commits if commit.title.startswith("Add cached files")]
+            self.assertEqual(len(files_commits), 1, "All the cached files should have been pushed in a single commit.")
+            self.assertGreater(len(commits), num_commits_before)
+
+            files_in_repo = api.list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
+            for cached_file in cached_files:
+                anonymous_path = remove_ip_adress_from_path(path_after_folder(cached_file, cache_dir))
+                self.assertIn(f"{neuron_hash.cache_path}/{anonymous_path}", files_in_repo)
+            self.assertEqual(len(cached_model_on_the_hub.files_on_the_hub), len(cached_files))
+
+            # Pushing the same files again should not create any new commit for them.
+            with self.assertLogs("optimum", level="INFO") as cm:
+                push_files_to_cache_on_hub(
+                    neuron_hash,
+                    cached_files,
+                    self.CUSTOM_PRIVATE_CACHE_REPO,
+                    local_path_to_path_in_repo=local_path_to_path_in_repo,
+                )
+                self.assertIn("Did not push the cached model located at", cm.output[0])
+            commits = api.list_repo_commits(self.CUSTOM_PRIVATE_CACHE_REPO)
+            files_commits = [commit for commit in commits if commit.title.startswith("Add cached files")]
+            self.assertEqual(len(files_commits), 1)
+
+    def test_push_files_to_cache_on_hub_removes_ip_adress_from_path_in_repo(self):
+        with TemporaryDirectory() as tmpdirname:
+            input_shapes = (("x", (1,)),)
+            data_type = torch.float32
+            tiny_model = self.create_tiny_pretrained_model(random_num_linears=True)
+            neuron_hash = NeuronHash(tiny_model, input_shapes, data_type)
+
+            cache_dir = Path(tmpdirname) / NEURON_COMPILE_CACHE_NAME
+            cached_file = cache_dir / "USER_neuroncc-2.4.0+ip-10-0-12-34-" / "MODULE_1234+ip-10-0-12-34-" / "a.neff"
+            cached_file.parent.mkdir(parents=True)
+            cached_file.write_bytes(os.urandom(16))
+
+            cached_model_on_the_hub = push_files_to_cache_on_hub(
+                neuron_hash,
+                [cached_file],
+                self.CUSTOM_PRIVATE_CACHE_REPO,
+                local_path_to_path_in_repo=lambda path: path_after_folder(path, cache_dir),
+            )
+
+            anonymous_path_in_repo = f"{neuron_hash.cache_path}/USER_neuroncc-2.4.0+/MODULE_1234+/a.neff"
+            files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
+            self.assertIn(anonymous_path_in_repo, files_in_repo)
+            self.assertFalse(any("ip-10-0-12-34-" in filename for filename in files_in_repo))
+            self.assertListEqual(cached_model_on_the_hub.files_on_the_hub, [anonymous_path_in_repo])
+
     def test_push_to_hub_without_writing_rights(self):
         with TemporaryDirectory() as tmpdirname:
             set_neuron_cache_path(tmpdirname)
@@ -17,10 +17,11 @@ import os
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from unittest import TestCase
+from unittest.mock import patch
 
 import torch
 from huggingface_hub import HfApi
-from transformers import TrainingArguments
+from transformers import TrainerControl, TrainerState, TrainingArguments
 from transformers.testing_utils import is_staging_test
 
 from optimum.neuron.trainers import NeuronCacheCallback
@@ -36,9 +37,35 @@ from optimum.neuron.utils.testing_utils import is_trainium_test
 from .utils import StagingTestMixin
 
 
+@is_trainium_test
+class NeuronCacheCallbackTestCase(TestCase):
+    def test_wait_for_everyone_on_fetch(self):
+        num_steps = 3
+        for kwargs, expected_num_calls in [
+            ({"wait_for_everyone_on_fetch": False, "wait_for_everyone_on_first_fetch": True}, 1),
+            ({"wait_for_everyone_on_fetch": True}, num_steps),
+            ({"wait_for_everyone_on_fetch": False, "wait_for_everyone_on_first_fetch": False}, 0),
+            ({"wait_for_everyone_on_fetch": False}, 0),
+        ]:
+            with self.subTest(**kwargs):
+                with TemporaryDirectory() as tmpdirname:
+                    args = TrainingArguments(tmpdirname)
+                    callback = NeuronCacheCallback(
+                        tmp_neuron_cache=Path(tmpdirname) / "tmp_cache",
+                        original_neuron_cache_path=Path(tmpdirname) / "cache",
+                        fetch=False,
+                        push=False,
+                        **kwargs,
+                    )
+                    with patch("optimum.neuron.trainer_callback.xm.rendezvous") as mock_rendezvous:
+                        for _ in range(num_steps):
+                            callback.on_step_middle(args, TrainerState(), TrainerControl())
+                    self.assertEqual(mock_rendezvous.call_count, expected_num_calls)
+
+
 @is_trainium_test
 @is_staging_test
-class NeuronCacheCallbackTestCase(StagingTestMixin, TestCase):
+class StagingNeuronCacheCallbackTestCase(StagingTestMixin, TestCase):
     def test_neuron_hash_for_model(self):
         with TemporaryDirectory() as tmpdirname:
             args = TrainingArguments(tmpdirname)
@@ -13,27 +13,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
 import json
 import os
 import random
 import subprocess
 import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from typing import FrozenSet, List, Tuple
 from unittest import TestCase
+from unittest.mock import patch
 
 from huggingface_hub import HfApi, delete_repo
+from huggingface_hub.hf_api import RepoFile
 from huggingface_hub.utils import RepositoryNotFoundError
-from transformers import BertConfig, BertModel, BertTokenizer, TrainingArguments
+from transformers import BertConfig, BertModel, BertTokenizer, PreTrainedModel, TrainingArguments
 from transformers.testing_utils import is_staging_test
 
 from optimum.neuron.trainers import NeuronTrainer
+from optimum.neuron.utils import is_torch_xla_available
 from optimum.neuron.utils.cache_utils import (
     get_neuron_cache_path,
     list_files_in_neuron_cache,
-    remove_ip_adress_from_path,
+    remove_ip_adress_from_paths,
     set_neuron_cache_path,
 )
 from optimum.neuron.utils.testing_utils import is_trainium_test
@@ -45,103 +49,146 @@ from .utils import (
     create_dummy_text_classification_dataset,
     create_tiny_pretrained_model,
     get_random_string,
+    get_visible_files,
+    iter_visible_files,
 )
 
 
+if is_torch_xla_available():
+    import torch_xla.core.xla_model as xm
+
+# Compiled graphs and logs are written to RAM when a tmpfs is available, instead of the disk backing /tmp.
+TMPFS_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
 @is_trainium_test
 @is_staging_test
 class StagingNeuronTrainerTestCase(StagingTestMixin, TestCase):
+    # We take batch sizes that do not divide the total number of samples.
+    NUM_TRAIN_SAMPLES = 1000
+    PER_DEVICE_TRAIN_BATCH_SIZE = 32
+    NUM_EVAL_SAMPLES = 100
+    PER_DEVICE_EVAL_BATCH_SIZE = 16
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        # A single client pinned to the staging token is reused for every listing done by the tests.
+        cls.api = HfApi(token=cls._staging_token)
+
+        # Built once and shared across tests, tests get fresh copies of the prototype model from `_new_model`.
+        cls._proto_model = create_tiny_pretrained_model(
+            random_num_linears=True, visited_num_linears=cls.visited_num_linears
+        )
+        cls._proto_state_dict = {k: v.detach().clone() for k, v in cls._proto_model.state_dict().items()}
+        cls._train_dataset = create_dummy_dataset({"x": (1,), "labels": (1,)}, cls.NUM_TRAIN_SAMPLES)
+        cls._eval_dataset = create_dummy_dataset({"x": (1,), "labels": (1,)}, cls.NUM_EVAL_SAMPLES)
+
+    def _new_model(self) -> PreTrainedModel:
+        """
+        Instantiates a model with the same architecture and weights as the prototype model.
+        """
+        model = self._proto_model.__class__(self._proto_model.config)
+        model.load_state_dict(self._proto_state_dict)
+        return model
+
+    def _files(self, repo_id: str) -> FrozenSet[str]:
+        entries = self.api.list_repo_tree(repo_id=repo_id, recursive=True)
+        return frozenset(get_visible_files(entry.path for entry in entries if isinstance(entry, RepoFile)))
+
+    def _repo_has_files(self, repo_id: str) -> bool:
+        # The tree is fetched page by page, so we can stop at the first visible file.
+        entries = self.api.list_repo_tree(repo_id=repo_id, recursive=True)
+        files = iter_visible_files(entry.path for entry in entries if isinstance(entry, RepoFile))
+        return next(files, None) is not None
+
+    def _snapshot(self, repo_id: str, cache_path: Path) -> Tuple[FrozenSet[str], FrozenSet[Path]]:
+        """
+        Lists the files in the cache repo on the Hub and in the local Neuron cache concurrently, so that the network
+        round trip overlaps with the local file system walk.
+
+        Sets are returned because the order in which the Hub lists the files is not guaranteed.
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            repo_future = executor.submit(self._files, repo_id)
+            cache_future = executor.submit(list_files_in_neuron_cache, cache_path, only_relevant_files=True)
+            return repo_future.result(), frozenset(cache_future.result())
+
+    def _run_training(self, model: PreTrainedModel, output_dir: str) -> float:
+        """
+        Trains and evaluates `model` on the shared dummy datasets and returns the training duration in seconds.
+        """
+        args = TrainingArguments(
+            output_dir,
+            do_train=True,
+            do_eval=True,
+            bf16=True,
+            per_device_train_batch_size=self.PER_DEVICE_TRAIN_BATCH_SIZE,
+            per_device_eval_batch_size=self.PER_DEVICE_EVAL_BATCH_SIZE,
+            # Nothing is asserted on checkpoints, saving would only add device syncs and disk writes.
+            save_strategy="no",
+            num_train_epochs=2,
+        )
+        trainer = NeuronTrainer(
+            model,
+            args,
+            train_dataset=self._train_dataset,
+            eval_dataset=self._eval_dataset,
+        )
+        # XLA executes lazily, so we wait for the device to be done to time the actual work.
+        xm.wait_device_ops()
+        start = time.time()
+        trainer.train()
+        xm.wait_device_ops()
+        end = time.time()
+        return end - start
+
     def test_train_and_eval(self):
         os.environ["CUSTOM_CACHE_REPO"] = self.CUSTOM_PRIVATE_CACHE_REPO
 
-        # We take a batch size that does not divide the total number of samples.
-        num_train_samples = 1000
-        per_device_train_batch_size = 32
-        dummy_train_dataset = create_dummy_dataset({"x": (1,), "labels": (1,)}, num_train_samples)
-
-        # We take a batch size that does not divide the total number of samples.
-        num_eval_samples = 100
-        per_device_eval_batch_size = 16
-        dummy_eval_dataset = create_dummy_dataset({"x": (1,), "labels": (1,)}, num_eval_samples)
+        model = self._new_model()
+        clone = self._new_model()
 
-        model = create_tiny_pretrained_model(random_num_linears=True)
-        clone = copy.deepcopy(model)
-
-        with TemporaryDirectory() as tmpdirname:
+        with TemporaryDirectory(dir=TMPFS_DIR) as tmpdirname:
             set_neuron_cache_path(tmpdirname)
 
-            files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            files_in_repo = [f for f in files_in_repo if not f.startswith(".")]
-            files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            self.assertListEqual(files_in_repo, [], "Repo should be empty.")
-            self.assertListEqual(files_in_cache, [], "Cache should be empty.")
-
-            args = TrainingArguments(
-                tmpdirname,
-                do_train=True,
-                do_eval=True,
-                bf16=True,
-                per_device_train_batch_size=per_device_train_batch_size,
-                per_device_eval_batch_size=per_device_eval_batch_size,
-                save_steps=10,
-                num_train_epochs=2,
-            )
-            trainer = NeuronTrainer(
-                model,
-                args,
-                train_dataset=dummy_train_dataset,
-                eval_dataset=dummy_eval_dataset,
+            self.assertFalse(self._repo_has_files(self.CUSTOM_PRIVATE_CACHE_REPO), "Repo should be empty.")
+            self.assertListEqual(
+                list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True),
+                [],
+                "Cache should be empty.",
             )
-            start = time.time()
-            trainer.train()
-            end = time.time()
-            first_training_duration = end - start
 
-            files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            files_in_repo = [f for f in files_in_repo if not f.startswith(".")]
-            files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            self.assertNotEqual(files_in_repo, [], "Repo should not be empty after first training.")
-            self.assertNotEqual(files_in_cache, [], "Cache should not be empty after first training.")
+            # The graphs are deliberately not precompiled (e.g. with `neuron_parallel_compile`) before this run: the
+            # cache callback does not push anything during precompilation and the graphs would already be in the local
+            # cache, so the Hub cache would stay empty and there would be no cold run to compare against.
+            first_training_duration = self._run_training(model, tmpdirname)
 
-        with TemporaryDirectory() as tmpdirname:
+            files_in_repo, files_in_cache = self._snapshot(self.CUSTOM_PRIVATE_CACHE_REPO, get_neuron_cache_path())
+            self.assertNotEqual(files_in_repo, set(), "Repo should not be empty after first training.")
+            self.assertNotEqual(files_in_cache, set(), "Cache should not be empty after first training.")
+
+        with TemporaryDirectory(dir=TMPFS_DIR) as tmpdirname:
             set_neuron_cache_path(tmpdirname)
 
-            new_files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            new_files_in_repo = [f for f in new_files_in_repo if not f.startswith(".")]
-            new_files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            self.assertNotEqual(new_files_in_repo, [], "Repo should not be empty.")
-            self.assertListEqual(new_files_in_cache, [], "Cache should be empty.")
-
-            args = TrainingArguments(
-                tmpdirname,
-                do_train=True,
-                do_eval=True,
-                bf16=True,
-                per_device_train_batch_size=per_device_train_batch_size,
-                per_device_eval_batch_size=per_device_eval_batch_size,
-                save_steps=10,
-                num_train_epochs=2,
-            )
-            trainer = NeuronTrainer(
-                clone,
-                args,
-                train_dataset=dummy_train_dataset,
-                eval_dataset=dummy_eval_dataset,
+            self.assertTrue(self._repo_has_files(self.CUSTOM_PRIVATE_CACHE_REPO), "Repo should not be empty.")
+            self.assertListEqual(
+                list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True),
+                [],
+                "Cache should be empty.",
             )
-            start = time.time()
-            trainer.train()
-            end = time.time()
-            second_training_duration = end - start
 
-            last_files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            last_files_in_repo = [f for f in last_files_in_repo if not f.startswith(".")]
-            last_files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            last_files_in_cache = [remove_ip_adress_from_path(p) for p in last_files_in_cache]
+            second_training_duration = self._run_training(clone, tmpdirname)
+
+            last_files_in_repo, last_files_in_cache = self._snapshot(
+                self.CUSTOM_PRIVATE_CACHE_REPO, get_neuron_cache_path()
+            )
+            last_files_in_cache = frozenset(remove_ip_adress_from_paths(last_files_in_cache))
             # TODO: investigate that, not urgent.
-            # self.assertListEqual(
+            # self.assertSetEqual(
             #     files_in_repo, last_files_in_repo, "No file should have been added to the Hub after first training."
             # )
-            # self.assertListEqual(
+            # self.assertSetEqual(
             #     files_in_cache,
             #     last_files_in_cache,
             #     "No file should have been added to the cache after first training.",
@@ -200,118 +247,110 @@ class StagingNeuronTrainerTestCase(StagingTestMixin, TestCase):
         except RepositoryNotFoundError:
             pass
 
-    @unittest.skip("Need to understand how to work with staging and datasets")
-    def test_train_and_eval_multiple_workers(self):
-        os.environ["CUSTOM_CACHE_REPO"] = self.CUSTOM_PRIVATE_CACHE_REPO
-
-        dataset_name, model_name = self.create_model_and_dataset_on_staging_hub()
-
-        with TemporaryDirectory() as tmpdirname:
+    def _run_torchrun(self, cmd: List[str]) -> subprocess.CompletedProcess:
+        """
+        Runs `cmd` while streaming its outputs to a log file instead of a pipe, the log is only printed on failure.
+        """
+        with NamedTemporaryFile(prefix=f"torchrun_{os.getpid()}_", suffix=".log", dir=TMPFS_DIR) as log_file:
+            proc = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT, check=False)
+            if proc.returncode != 0:
+                log_file.seek(0)
+                print(log_file.read().decode("utf-8", errors="replace"))
+        return proc
+
+    def _run_torchrun_training_once(
+        self, cmd: List[str], expect_empty_repo: bool
+    ) -> Tuple[float, FrozenSet[str], FrozenSet[Path]]:
+        """
+        Runs the torchrun training command `cmd` with a fresh Neuron cache and returns the training duration along with
+        the files in the cache repo and in the local Neuron cache after training.
+        """
+        run_name = "first" if expect_empty_repo else "second"
+        with TemporaryDirectory(dir=TMPFS_DIR) as tmpdirname:
             set_neuron_cache_path(tmpdirname)
 
-            files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            files_in_repo = [f for f in files_in_repo if not f.startswith(".")]
-            files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            self.assertListEqual(files_in_repo, [], "Repo should be empty.")
-            self.assertListEqual(files_in_cache, [], "Cache should be empty.")
-
-            cmd = [
-                "torchrun",
-                "--nproc_per_node=2",
-                "examples/text-classification/run_glue.py",
-                f"--model_name_or_path={model_name}",
-                f"--dataset_name={dataset_name}",
-                "--per_device_train_batch_size=16",
-                "--per_device_eval_batch_size=16",
-                f"--output_dir={tmpdirname}",
-                "--save_strategy=steps",
-                "--save_steps=10",
-                "--max_steps=100",
-                "--do_train",
-                "--do_eval",
-                "--bf16",
-            ]
+            if expect_empty_repo:
+                self.assertFalse(self._repo_has_files(self.CUSTOM_PRIVATE_CACHE_REPO), "Repo should be empty.")
+            else:
+                self.assertTrue(self._repo_has_files(self.CUSTOM_PRIVATE_CACHE_REPO), "Repo should not be empty.")
+            self.assertListEqual(
+                list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True),
+                [],
+                "Cache should be empty.",
+            )
 
             start = time.time()
-            proc = subprocess.Popen(cmd, stderr=subprocess.PIPE)
+            proc = self._run_torchrun(cmd + [f"--output_dir={tmpdirname}"])
             end = time.time()
-            first_training_duration = end - start
 
-            _, stderr = proc.communicate()
-            stderr = stderr.decode("utf-8")
-            if stderr:
-                print(stderr)
+            self.assertEqual(proc.returncode, 0, f"The {run_name} torchrun training command failed.")
 
-            self.assertEqual(proc.returncode, 0, "The first torchrun training command failed.")
+            files_in_repo, files_in_cache = self._snapshot(self.CUSTOM_PRIVATE_CACHE_REPO, get_neuron_cache_path())
+            files_in_cache = frozenset(remove_ip_adress_from_paths(files_in_cache))
+        return end - start, files_in_repo, files_in_cache
 
-            files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            files_in_repo = [f for f in files_in_repo if not f.startswith(".")]
-            files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            self.assertNotEqual(files_in_repo, [], "Repo should not be empty after first training.")
-            self.assertNotEqual(files_in_cache, [], "Cache should not be empty after first training.")
-
-        with TemporaryDirectory() as tmpdirname:
-            set_neuron_cache_path(tmpdirname)
-
-            new_files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            new_files_in_repo = [f for f in new_files_in_repo if not f.startswith(".")]
-            new_files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            self.assertNotEqual(new_files_in_repo, [], "Repo should not be empty.")
-            self.assertListEqual(new_files_in_cache, [], "Cache should be empty.")
-
-            cmd = [
-                "torchrun",
-                "--nproc_per_node=2",
-                "examples/text-classification/run_glue.py",
-                f"--model_name_or_path={model_name}",
-                f"--dataset_name={dataset_name}",
-                "--per_device_train_batch_size=16",
-                "--per_device_eval_batch_size=16",
-                f"--output_dir={tmpdirname}",
-                "--save_strategy=steps",
-                "--save_steps=10",
-                "--max_steps=100",
-                "--do_train",
-                "--do_eval",
-                "--bf16",
-            ]
-
-            start = time.time()
-            proc = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-            end = time.time()
-            second_training_duration = end - start
-
-            _, stderr = proc.communicate()
-            stderr = stderr.decode("utf-8")
-            if stderr:
-                print(stderr)
-
-            self.assertEqual(proc.returncode, 0, "The second torchrun training command failed.")
+    @unittest.skip("Need to understand how to work with staging and datasets")
+    def test_train_and_eval_multiple_workers(self):
+        os.environ["CUSTOM_CACHE_REPO"] = self.CUSTOM_PRIVATE_CACHE_REPO
 
-            last_files_in_repo = HfApi().list_repo_files(repo_id=self.CUSTOM_PRIVATE_CACHE_REPO)
-            last_files_in_repo = [f for f in last_files_in_repo if not f.startswith(".")]
-            last_files_in_cache = list_files_in_neuron_cache(get_neuron_cache_path(), only_relevant_files=True)
-            last_files_in_cache = [remove_ip_adress_from_path(p) for p in last_files_in_cache]
-            # TODO: investigate that, not urgent.
-            # self.assertListEqual(
-            #     files_in_repo, last_files_in_repo, "No file should have been added to the Hub after first training."
-            # )
-            # self.assertListEqual(
-            #     files_in_cache,
-            #     last_files_in_cache,
-            #     "No file should have been added to the cache after first training.",
-            # )
+        dataset_name, model_name = self.create_model_and_dataset_on_staging_hub()
 
-            self.assertTrue(
-                second_training_duration < first_training_duration,
-                "Second training should be faster because cached graphs can be used.",
-            )
+        cmd = [
+            "torchrun",
+            "--standalone",
+            "--nnodes=1",
+            "--nproc_per_node=2",
+            "examples/text-classification/run_glue.py",
+            f"--model_name_or_path={model_name}",
+            f"--dataset_name={dataset_name}",
+            "--per_device_train_batch_size=16",
+            "--per_device_eval_batch_size=16",
+            "--save_strategy=no",
+            "--max_steps=100",
+            "--do_train",
+            "--do_eval",
+            "--bf16",
+        ]
+
+        first_training_duration, files_in_repo, files_in_cache = self._run_torchrun_training_once(
+            cmd, expect_empty_repo=True
+        )
+        self.assertNotEqual(files_in_repo, set(), "Repo should not be empty after first training.")
+        self.assertNotEqual(files_in_cache, set(), "Cache should not be empty after first training.")
+
+        second_training_duration, last_files_in_repo, last_files_in_cache = self._run_torchrun_training_once(
+            cmd, expect_empty_repo=False
+        )
+        # TODO: investigate that, not urgent.
+        # self.assertSetEqual(
+        #     files_in_repo, last_files_in_repo, "No file should have been added to the Hub after first training."
+        # )
+        # self.assertSetEqual(
+        #     files_in_cache,
+        #     last_files_in_cache,
+        #     "No file should have been added to the cache after first training.",
+        # )
+
+        self.assertTrue(
+            second_training_duration < first_training_duration,
+            "Second training should be faster because cached graphs can be used.",
+        )
 
         self.remove_model_and_dataset_on_staging_hub(dataset_name, model_name)
 
 
 @is_trainium_test
 class NeuronTrainerTestCase(TestCase):
+    def test_bf16_is_mapped_to_xla_use_bf16(self):
+        # With `bf16=True` the whole training, including gradients and optimizer states, must run in bf16 through
+        # `XLA_USE_BF16` instead of mixed-precision, so that no mixed-precision graphs are compiled and cached.
+        with TemporaryDirectory() as tmpdirname, patch.dict(os.environ):
+            os.environ.pop("XLA_USE_BF16", None)
+            args = TrainingArguments(tmpdirname, bf16=True)
+            trainer = NeuronTrainer(create_tiny_pretrained_model(), args)
+            self.assertEqual(os.environ.get("XLA_USE_BF16"), "1")
+            self.assertIs(trainer.args.bf16, False)
+
     def _test_training_with_fsdp_mode(self, fsdp_mode: str):
         model_name = "prajjwal1/bert-tiny"
         task_name = "sst2"
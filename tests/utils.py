@@ -20,7 +20,7 @@ import shutil
 import string
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Dict, Optional, Set, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 import torch
 from datasets import Dataset, DatasetDict
@@ -49,12 +49,38 @@ def get_random_string(length) -> str:
     return "".join(random.choice(letters) for _ in range(length))
 
 
-def create_dummy_dataset(input_specs: Dict[str, Tuple[int, ...]], num_examples: int) -> Dataset:
-    def gen():
-        for _ in range(num_examples):
-            yield {name: torch.rand(shape) for name, shape in input_specs.items()}
+def iter_visible_files(filenames: Iterable[str]) -> Iterator[str]:
+    """
+    Lazily filters out hidden files (e.g. `.gitattributes`) from filenames returned by the Hub.
+    """
+    return (filename for filename in filenames if filename[:1] != ".")
 
-    return Dataset.from_generator(gen)
+
+def get_visible_files(filenames: Iterable[str]) -> List[str]:
+    """
+    Filters out hidden files (e.g. `.gitattributes`) from a list of filenames returned by the Hub.
+    """
+    return list(iter_visible_files(filenames))
+
+
+class DummyDataset(torch.utils.data.Dataset):
+    """
+    Dataset storing each feature as a single contiguous tensor, examples are views on these tensors.
+    """
+
+    def __init__(self, input_specs: Dict[str, Tuple[int, ...]], num_examples: int):
+        self.num_examples = num_examples
+        self.features = {name: torch.rand((num_examples,) + tuple(shape)) for name, shape in input_specs.items()}
+
+    def __len__(self) -> int:
+        return self.num_examples
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        return {name: feature[idx] for name, feature in self.features.items()}
+
+
+def create_dummy_dataset(input_specs: Dict[str, Tuple[int, ...]], num_examples: int) -> DummyDataset:
+    return DummyDataset(input_specs, num_examples)
 
 
 def create_dummy_text_classification_dataset(
@@ -126,6 +152,8 @@ def create_tiny_pretrained_model(
     config = PretrainedConfig()
     config.num_linears = num_linears
 
+    # The model is built on CPU in the default dtype on purpose: moving it to the XLA device is left to the caller (the
+    # trainer does it in a single transfer), and with `bf16=True` the casting is handled by `XLA_USE_BF16`.
     return MyTinyModel(config)
 
 